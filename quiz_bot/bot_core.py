@@ -1,11 +1,16 @@
 import logging
-from typing import Dict, Any
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+from cachetools import TTLCache
 
 import config
 import utils
 import handlers
 import conversation
 import game
+from models import GameState
+from scores import BestScoresStore
 
 logger = logging.getLogger(__name__)
 
@@ -22,30 +27,81 @@ class TriviaBot:
         
         # --- State ---
         # Stores active games, keyed by user_id
-        self.current_games: Dict[int, Dict[str, Any]] = {} 
+        self.current_games: Dict[int, GameState] = {} 
+        # Stores in-progress quiz setup choices, keyed by user_id; abandoned setups expire
+        self.quiz_setups: TTLCache = TTLCache(maxsize=config.QUIZ_SETUP_MAX_USERS, ttl=config.QUIZ_SETUP_TTL)
         # Stores category ID -> category name mapping
         self.categories: Dict[int, str] = {} 
-        # Stores best scores, keyed by utils.get_best_score_key()
-        self.best_scores: Dict[int, Dict[str, int]] = {} 
+        # (category_id, category_name) pairs sorted by name, built once for keyboards
+        self.sorted_categories: Tuple[Tuple[int, str], ...] = ()
+        # Stores best scores per user, keyed by utils.get_best_score_key(); opened in _load_initial_data
+        self.scores_store: Optional[BestScoresStore] = None
         
+        # Shared HTTP session for Trivia API calls, opened in post_init
+        self.http_session: Optional[aiohttp.ClientSession] = None
+
         # --- Configuration ---
         self.answer_timeout = config.ANSWER_TIMEOUT
-        self.best_scores_file = config.BEST_SCORES_FILE
+        self.best_scores_db = config.BEST_SCORES_DB
+
+        # --- Callback Routing ---
+        # Maps the callback data prefix (text before the first '_') to its handler
+        self._callback_handlers = {
+            'difficulty': self.select_difficulty_callback,
+            'category': self.select_category_callback,
+            'length': self.start_quiz_callback,
+            'ans': self.answer_callback,
+        }
 
         # --- Initialization ---
         self._load_initial_data()
         
     def _load_initial_data(self):
-        """Loads categories and best scores on startup."""
+        """Opens the best scores database on startup. Categories are loaded in post_init, once the HTTP session exists."""
         logger.info("Loading initial data...")
-        self.categories = utils.fetch_trivia_categories()
+        self.scores_store = BestScoresStore(self.best_scores_db)
+        if self.scores_store.is_empty():
+            # One-time migration from the old JSON file
+            legacy_scores = utils.load_best_scores()
+            if legacy_scores:
+                self.scores_store.import_scores(legacy_scores)
+                logger.info(f"Imported best scores for {len(legacy_scores)} users from '{config.BEST_SCORES_FILE}'.")
+        logger.info(f"Using best scores database '{self.best_scores_db}'.")
+
+    # --- Application Lifecycle ---
+
+    async def post_init(self, application):
+        """Opens the shared HTTP session once the event loop is running and loads categories."""
+        self.http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=config.HTTP_CONNECTION_LIMIT,
+                keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT
+            ),
+            timeout=aiohttp.ClientTimeout(total=config.API_REQUEST_TIMEOUT)
+        )
+
+        await self.refresh_categories()
         if not self.categories:
-             logger.warning("Failed to fetch trivia categories on startup. Category selection may fail.")
+             logger.warning("Failed to fetch trivia categories on startup. They will be retried on the next quiz setup.")
         else:
              logger.info(f"Loaded {len(self.categories)} categories.")
-             
-        self.best_scores = utils.load_best_scores()
-        logger.info(f"Loaded best score records for {len(self.best_scores)} users from '{self.best_scores_file}'.")
+
+    async def refresh_categories(self):
+        """
+        Refreshes categories from the API (served from cache within CATEGORIES_CACHE_TTL)
+        and rebuilds the sorted keyboard tuple only when the category list changed.
+        """
+        categories = await utils.fetch_trivia_categories(self.http_session)
+        if categories and categories is not self.categories:
+            self.categories = categories
+            self.sorted_categories = tuple(sorted(categories.items(), key=lambda item: item[1]))
+
+    async def post_shutdown(self, application):
+        """Closes the shared HTTP session and the best scores database."""
+        if self.http_session:
+            await self.http_session.close()
+        if self.scores_store:
+            self.scores_store.close()
 
     # --- Method Wrappers for Handlers ---
 
@@ -56,21 +112,31 @@ class TriviaBot:
     async def stop_quiz_command(self, update, context):
         await handlers.handle_stop_quiz(update, context, self)
 
-    # Conversation Handlers (need to return state for ConversationHandler)
     async def start_conversation(self, update, context):
-        return await conversation.handle_start_conversation(update, context, self)
+        await conversation.handle_start_conversation(update, context, self)
+
+    async def cancel_conversation(self, update, context):
+        await conversation.handle_cancel_conversation(update, context, self)
+
+    # Callback Query Handlers
+    async def dispatch_callback(self, update, context):
+        """Routes every callback query to its handler by the prefix of its data."""
+        query = update.callback_query
+        if not query or not query.data:
+            return
+        handler = self._callback_handlers.get(query.data.split('_', 1)[0])
+        if handler:
+            await handler(update, context)
+        else:
+            logger.warning(f"Unknown callback data received: {query.data}")
+            await query.answer()
 
     async def select_difficulty_callback(self, update, context):
-        return await conversation.handle_select_difficulty(update, context, self)
+        await conversation.handle_select_difficulty(update, context, self)
 
     async def select_category_callback(self, update, context):
-        return await conversation.handle_select_category(update, context, self)
-        
-    async def cancel_conversation(self, update, context):
-        return await conversation.handle_cancel_conversation(update, context)
-
+        await conversation.handle_select_category(update, context, self)
 
-    # Game Logic Callbacks (outside conversation)
     async def start_quiz_callback(self, update, context):
         await game.handle_start_quiz(update, context, self)
 
@@ -22,22 +22,36 @@ ANSWER_TIMEOUT = 30
 # Default number of questions options for the user to choose from
 DEFAULT_GAME_LENGTHS = [10, 25, 50]
 
+# Quiz setups (difficulty/category picks) abandoned for this many seconds are discarded
+QUIZ_SETUP_TTL = 600
+# Maximum number of in-progress quiz setups kept in memory
+QUIZ_SETUP_MAX_USERS = 10000
+
 # --- API Settings ---
 # Open Trivia Database API URLs
 TRIVIA_API_CATEGORY_URL = "https://opentdb.com/api_category.php"
 TRIVIA_API_QUESTIONS_URL = "https://opentdb.com/api.php"
+TRIVIA_API_TOKEN_URL = "https://opentdb.com/api_token.php"
+# Seconds to reuse the fetched category list before asking the API again
+CATEGORIES_CACHE_TTL = 3600
 # Timeout in seconds for API requests
 API_REQUEST_TIMEOUT = 10
+# Questions fetched before the first one is shown; the rest are fetched in the background
+QUESTION_PREFETCH_BATCH = 5
+# Open Trivia DB allows one request per IP every 5 seconds
+API_RATE_LIMIT_DELAY = 5
+# Consecutive empty background fetches before a game is cut short to the questions it has
+QUESTION_PREFETCH_ATTEMPTS = 6
+# Shared HTTP session connection pool: max open connections and idle keep-alive in seconds
+HTTP_CONNECTION_LIMIT = 20
+HTTP_KEEPALIVE_TIMEOUT = 60
 
 # --- Data Persistence ---
-# File to store best scores
+# SQLite database storing best scores
+BEST_SCORES_DB = 'best_scores.db'
+# Legacy JSON best scores file, imported into the database on first start
 BEST_SCORES_FILE = 'best_scores.json'
 
-# --- Conversation States ---
-# Used by ConversationHandler
-DIFFICULTY_SELECTION, CATEGORY_SELECTION = range(2)
-
-
 # --- Validation ---
 if not TELEGRAM_BOT_TOKEN:
     logging.error("FATAL ERROR: TELEGRAM_BOT_TOKEN not found in environment variables.")
@@ -2,9 +2,10 @@ import logging
 from typing import TYPE_CHECKING
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, ConversationHandler
+from telegram.ext import ContextTypes
 
 import config
+import utils
 
 # Avoid circular import for type hinting
 if TYPE_CHECKING:
@@ -12,7 +13,7 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
-async def handle_start_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE, bot: 'TriviaBot') -> int:
+async def handle_start_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE, bot: 'TriviaBot') -> None:
     """Starts the quiz configuration conversation (/start_quiz command)."""
     if update.message:
         await update.message.reply_text(
@@ -42,56 +43,45 @@ async def handle_start_conversation(update: Update, context: ContextTypes.DEFAUL
              logger.error("Cannot send difficulty selection - no message and no chat_id.")
 
 
-    return config.DIFFICULTY_SELECTION # Next state
-
-async def handle_select_difficulty(update: Update, context: ContextTypes.DEFAULT_TYPE, bot: 'TriviaBot') -> int:
+async def handle_select_difficulty(update: Update, context: ContextTypes.DEFAULT_TYPE, bot: 'TriviaBot') -> None:
     """Handles difficulty selection (callback query starting with 'difficulty_')."""
     query = update.callback_query
     if not query or not query.data or not query.message:
          logger.warning("handle_select_difficulty called without valid query.")
-         return ConversationHandler.END
+         return
 
     await query.answer()
 
     difficulty = query.data.split('_')[1]
-    context.user_data['difficulty'] = difficulty # Store selection in user_data
+    bot.quiz_setups[query.from_user.id] = {'difficulty': difficulty} # Store selection, starting a fresh setup
 
     logger.info(f"User {query.from_user.id} selected difficulty: {difficulty}")
 
-    # Create category selection keyboard
-    keyboard = []
-    current_row = []
-    sorted_categories = sorted(bot.categories.items(), key=lambda item: item[1]) # Sort alphabetically
-
-    for category_id, category_name in sorted_categories:
-        button = InlineKeyboardButton(category_name, callback_data=f"category_{category_id}")
-        current_row.append(button)
-        
-        if len(current_row) == 2: # Max 2 buttons per row
-            keyboard.append(current_row)
-            current_row = []
-    
-    if current_row: # Add any remaining button(s)
-        keyboard.append(current_row)
+    # Create category selection keyboard (categories are pre-sorted alphabetically)
+    await bot.refresh_categories()
+    buttons = [
+        InlineKeyboardButton(category_name, callback_data=f"category_{category_id}")
+        for category_id, category_name in bot.sorted_categories
+    ]
+    keyboard = utils.chunk_buttons(buttons, 2) # Max 2 buttons per row
 
     if not keyboard:
          await query.edit_message_text("Could not load categories. Please try /start_quiz again later.")
          logger.error("Category list is empty when trying to display.")
-         return ConversationHandler.END
+         return
 
     await query.edit_message_text(
         f"Difficulty: {difficulty.capitalize()}\n\nNow, select a Trivia Category:",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
-    return config.CATEGORY_SELECTION # Next state
 
-async def handle_select_category(update: Update, context: ContextTypes.DEFAULT_TYPE, bot: 'TriviaBot') -> int:
+async def handle_select_category(update: Update, context: ContextTypes.DEFAULT_TYPE, bot: 'TriviaBot') -> None:
     """Handles category selection (callback query starting with 'category_')."""
     query = update.callback_query
     if not query or not query.data or not query.message:
          logger.warning("handle_select_category called without valid query.")
-         return ConversationHandler.END
+         return
 
     await query.answer()
 
@@ -99,13 +89,15 @@ async def handle_select_category(update: Update, context: ContextTypes.DEFAULT_T
     try:
         category_id = int(category_id_str)
         category_name = bot.categories.get(category_id, "Unknown Category")
-        context.user_data['category'] = category_id # Store selection
+        setup = bot.quiz_setups.get(query.from_user.id, {})
+        setup['category'] = category_id
+        bot.quiz_setups[query.from_user.id] = setup # Store selection (re-assigning refreshes the expiry)
         logger.info(f"User {query.from_user.id} selected category ID: {category_id} ({category_name})")
 
     except (ValueError, IndexError):
          logger.error(f"Invalid category callback data received: {query.data}")
          await query.edit_message_text("Invalid category selection. Please try /start_quiz again.")
-         return ConversationHandler.END
+         return
 
     # Game length selection keyboard using values from config
     keyboard = [
@@ -116,7 +108,7 @@ async def handle_select_category(update: Update, context: ContextTypes.DEFAULT_T
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    difficulty = context.user_data.get('difficulty', 'N/A')
+    difficulty = setup.get('difficulty', 'N/A')
     await query.edit_message_text(
         f"Difficulty: {difficulty.capitalize()}\n"
         f"Category: {category_name}\n\n"
@@ -124,13 +116,10 @@ async def handle_select_category(update: Update, context: ContextTypes.DEFAULT_T
         reply_markup=reply_markup
     )
 
-    return ConversationHandler.END
-
-async def handle_cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def handle_cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE, bot: 'TriviaBot') -> None:
     """Cancels the quiz setup conversation."""
     if update.message:
         await update.message.reply_text("Quiz setup cancelled. Use /start_quiz to try again.")
     logger.info(f"User {update.effective_user.id} cancelled conversation.")
-    # Clean up user_data if necessary
-    context.user_data.clear()
-    return ConversationHandler.END
+    # Discard any partial setup
+    bot.quiz_setups.pop(update.effective_user.id, None)
@@ -3,59 +3,89 @@ import logging
 from typing import TYPE_CHECKING, Optional
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 
 import config
 import utils
+from models import GameState
 # Avoid circular import for type hinting
 if TYPE_CHECKING:
     from bot_core import TriviaBot 
 
 logger = logging.getLogger(__name__)
 
+# --- Quiz Message ---
+
+async def _show_in_quiz_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, game_state: GameState, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+    """
+    Shows text in the game's single quiz message, editing it in place.
+    The message is sent on first use, or re-sent if it was deleted from the chat.
+    """
+    quiz_message_id = game_state.quiz_message_id
+    if quiz_message_id is not None:
+        try:
+            await context.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=quiz_message_id,
+                text=text,
+                reply_markup=reply_markup
+            )
+            return
+        except BadRequest as e:
+            if "message to edit not found" not in str(e).lower():
+                raise
+            logger.warning(f"Quiz message {quiz_message_id} not found in chat {chat_id}. Sending a new one.")
+
+    sent_message = await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+    game_state.quiz_message_id = sent_message.message_id
+
+
 # --- Timeout Handling ---
 
 async def _handle_question_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, bot: 'TriviaBot'):
     """Internal function to process a question timeout."""
-    if user_id not in bot.current_games:
-        logger.debug(f"Timeout triggered for user {user_id}, but game no longer exists.")
+    game_state = bot.current_games.get(user_id)
+    if game_state is None:
+        logger.debug("Timeout triggered for user %s, but game no longer exists.", user_id)
         return
 
-    game_state = bot.current_games[user_id]
-    q_index = game_state['current_question_index']
+    questions = game_state.questions
+    unanswered = game_state.unanswered_indices
+    q_index = game_state.current_question_index
     
     # Ensure the timeout corresponds to the *current* question being displayed
-    if q_index >= len(game_state['questions']) or game_state['questions'][q_index]['answered']:
-         logger.debug(f"Timeout for user {user_id} on Q{q_index}, but it was already answered or out of bounds.")
+    if q_index >= len(questions) or questions[q_index].answered:
+         logger.debug("Timeout for user %s on Q%s, but it was already answered or out of bounds.", user_id, q_index)
          return # Question already answered or game moved on
 
-    current_q = game_state['questions'][q_index]
-    current_q['answered'] = True # Mark as answered (timed out)
+    current_q = questions[q_index]
+    current_q.answered = True # Mark as answered (timed out)
     
     # Safety check before removing - should always be present if unanswered
-    if q_index in game_state.get('unanswered_indices', []):
-        game_state['unanswered_indices'].remove(q_index)
+    if q_index in unanswered:
+        unanswered.remove(q_index)
 
     logger.info(f"User {user_id} timed out on question {q_index + 1}.")
 
     response_text = (
         f"⏰ Time's up for question {q_index + 1}!\n"
-        f"Correct Answer: {current_q['correct_answer']}\n\n"
-        f"Current Score: {game_state['score']}/{game_state['game_length']}"
+        f"Correct Answer: {current_q.correct_answer}\n\n"
+        f"Current Score: {game_state.score}/{game_state.game_length}"
     )
 
-    # Try sending message to the chat
+    # Show the result in the quiz message (removes the answer keyboard)
     chat_id = update.effective_chat.id if update.effective_chat else None
     if chat_id:
          try:
-             await context.bot.send_message(chat_id=chat_id, text=response_text)
+             await _show_in_quiz_message(context, chat_id, game_state, response_text)
          except Exception as e:
-             logger.error(f"Error sending timeout message to chat {chat_id}: {e}")
+             logger.error(f"Error showing timeout message in chat {chat_id}: {e}")
     else:
         logger.error(f"Cannot send timeout message: No chat ID found for user {user_id}.")
 
-
-    # Move to next question or end game
+    # Move to next question or end game, leaving the result visible briefly
+    await asyncio.sleep(1.5)
     await handle_send_next_question(update, context, bot)
 
 
@@ -67,7 +97,38 @@ async def _set_question_timeout(update: Update, context: ContextTypes.DEFAULT_TY
     if user_id in bot.current_games:
         await _handle_question_timeout(update, context, user_id, bot)
     else:
-        logger.debug(f"Timeout sleep finished for user {user_id}, but game ended before execution.")
+        logger.debug("Timeout sleep finished for user %s, but game ended before execution.", user_id)
+
+
+# --- Question Prefetch ---
+
+async def _prefetch_questions(bot: 'TriviaBot', game_state: GameState) -> None:
+    """
+    Fetches the rest of a game's questions in the background while the first batch is played.
+    An empty response (rate limit, or fewer questions left than requested) is retried
+    with half as many questions, so a transient failure doesn't cut the game short.
+    """
+    request_amount = game_state.game_length - len(game_state.questions)
+    failures = 0
+    while len(game_state.questions) < game_state.game_length and failures < config.QUESTION_PREFETCH_ATTEMPTS:
+        # Open Trivia DB rejects more than one request per IP every few seconds
+        await asyncio.sleep(config.API_RATE_LIMIT_DELAY)
+        remaining = game_state.game_length - len(game_state.questions)
+        amount = min(request_amount, remaining)
+        more_questions = await utils.fetch_trivia_questions(
+            bot.http_session, game_state.difficulty, game_state.category, amount, game_state.session_token
+        )
+        # Without a session token, separate requests may return the same question twice
+        seen = {q.question for q in game_state.questions}
+        new_questions = [q for q in more_questions if q.question not in seen]
+        if not new_questions:
+            failures += 1
+            # The API has no results when asked for more questions than it can still supply
+            request_amount = max(1, amount // 2)
+            continue
+        failures = 0
+        game_state.questions.extend(new_questions)
+        logger.debug("Prefetched %s more questions for game with %s total.", len(new_questions), game_state.game_length)
 
 
 # --- Game Flow ---
@@ -89,9 +150,10 @@ async def handle_start_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE,
         await query.edit_message_text("You already have a quiz in progress! Use /stop_quiz first if you want to start over.")
         return
         
-    # --- Get parameters from context and callback ---
-    difficulty = context.user_data.get('difficulty')
-    category = context.user_data.get('category')
+    # --- Get parameters from the stored setup and callback ---
+    setup = bot.quiz_setups.get(user_id, {})
+    difficulty = setup.get('difficulty')
+    category = setup.get('category')
     
     try:
         game_length_str = query.data.split('_')[1]
@@ -109,42 +171,48 @@ async def handle_start_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE,
     logger.info(f"Starting quiz for user {user_id}: Diff={difficulty}, Cat={category}, Len={game_length}")
     
     # --- Fetch Questions ---
+    # Only the first batch is fetched up front; the rest are prefetched while the user plays
     await query.edit_message_text("Starting quiz... Fetching questions...")
     
-    questions = utils.fetch_trivia_questions(difficulty, category, game_length)
+    # A session token keeps the prefetched batch from repeating questions of the first one
+    session_token = await utils.fetch_session_token(bot.http_session)
+    first_batch = min(game_length, config.QUESTION_PREFETCH_BATCH)
+    questions = await utils.fetch_trivia_questions(bot.http_session, difficulty, category, first_batch, session_token)
 
-    if not questions or len(questions) < game_length:
-        logger.warning(f"Could not fetch enough ({len(questions)}/{game_length}) questions for user {user_id}.")
+    if not questions or len(questions) < first_batch:
+        logger.warning(f"Could not fetch enough ({len(questions)}/{first_batch}) questions for user {user_id}.")
         await query.edit_message_text(
             "😕 Sorry, couldn't fetch enough questions for this combination.\n"
             "Maybe try a different category, difficulty, or length?\n"
             "Use /start_quiz to try again."
         )
         # Clean partial setup data
-        context.user_data.clear() 
+        bot.quiz_setups.pop(user_id, None)
         return
 
     # --- Initialize Game State ---
-    bot.current_games[user_id] = {
-        'difficulty': difficulty,
-        'category': category,
-        'category_name': bot.categories.get(category, "Unknown"), # Store name for end message
-        'game_length': game_length,
-        'questions': questions,
-        'current_question_index': 0, # Start at the first question
-        'unanswered_indices': list(range(game_length)), # List of indices yet to be asked/answered
-        'score': 0,
-        'timeout_task': None,
-        'last_message_id': None 
-    }
+    game_state = GameState(
+        difficulty=difficulty,
+        category=category,
+        category_name=bot.categories.get(category, "Unknown"),
+        game_length=game_length,
+        questions=questions,
+        unanswered_indices=list(range(game_length)),
+        session_token=session_token,
+    )
+    if game_length > first_batch:
+        game_state.prefetch_task = asyncio.create_task(
+            _prefetch_questions(bot, game_state)
+        )
+    bot.current_games[user_id] = game_state
 
     logger.info(f"Game state initialized for user {user_id}. Starting first question.")
     
     # --- Send First Question ---
     await handle_send_next_question(update, context, bot)
     
-    # Clean up setup data from user_data after successful start
-    context.user_data.clear() 
+    # Clean up setup data after successful start
+    bot.quiz_setups.pop(user_id, None)
 
 
 async def handle_send_next_question(update: Update, context: ContextTypes.DEFAULT_TYPE, bot: 'TriviaBot') -> None:
@@ -155,61 +223,72 @@ async def handle_send_next_question(update: Update, context: ContextTypes.DEFAUL
     query = update.callback_query
     chat_id = query.message.chat.id if query and query.message else update.effective_chat.id
     
-    if not user_id or user_id not in bot.current_games:
+    game_state = bot.current_games.get(user_id) if user_id else None
+    if game_state is None:
         # This might happen if a timeout triggers after /stop_quiz
-        logger.debug(f"handle_send_next_question called for user {user_id}, but no active game found.")
+        logger.debug("handle_send_next_question called for user %s, but no active game found.", user_id)
         # Optionally send a message if chat_id is known
         # if chat_id: await context.bot.send_message(chat_id, "No active game found.")
         return
 
-    game_state = bot.current_games[user_id]
+    # Bound once; the prefetch task extends the same questions list in place
+    questions = game_state.questions
+    unanswered = game_state.unanswered_indices
 
     # --- Check if Game Ended ---
-    if not game_state['unanswered_indices']:
+    if not unanswered:
         logger.info(f"No more unanswered questions for user {user_id}. Ending game.")
         await handle_end_game(update, context, bot)
         return
 
     # --- Get Next Question ---
     # Always take the first index from the remaining list
-    next_q_index = game_state['unanswered_indices'][0] 
-    game_state['current_question_index'] = next_q_index # Update current index track
-    current_q = game_state['questions'][next_q_index]
+    next_q_index = unanswered[0] 
+
+    # Wait for the background fetch if the user has caught up with it
+    # (asyncio.wait neither raises if it was cancelled nor cancels it if this handler is)
+    if next_q_index >= len(questions) and game_state.prefetch_task:
+        await asyncio.wait((game_state.prefetch_task,))
+        if bot.current_games.get(user_id) is not game_state:
+            return # Game was stopped while waiting
+
+    if next_q_index >= len(questions):
+        # The background fetch came up short; finish with the questions already played.
+        # game_length stays as chosen, so the score is never filed under a setup the user didn't pick.
+        logger.warning(f"Only {len(questions)}/{game_state.game_length} questions available for user {user_id}. Ending game early.")
+        game_state.truncated = True
+        unanswered.clear()
+        await handle_end_game(update, context, bot)
+        return
+
+    game_state.current_question_index = next_q_index # Update current index track
+    current_q = questions[next_q_index]
+    game_length = game_state.game_length
 
     # --- Create Keyboard ---
-    keyboard = []
-    # Create buttons in a 2-column layout if possible
-    answers = current_q['answers']
-    row = []
-    for i, answer in enumerate(answers):
-         # Callback data: "ans_{question_index}_{answer_index}"
-        row.append(InlineKeyboardButton(answer, callback_data=f"ans_{next_q_index}_{i}"))
-        if len(row) == (1 if len(answers) <= 2 else 2): # Single button per row if only 1 or 2 answers total
-            keyboard.append(row)
-            row = []
-    if row: # Add remaining button if odd number > 2
-        keyboard.append(row)
-        
+    answers = current_q.answers
+    # Callback data: "ans_{question_index}_{answer_index}"
+    answer_buttons = [
+        InlineKeyboardButton(answer, callback_data=f"ans_{next_q_index}_{i}")
+        for i, answer in enumerate(answers)
+    ]
+    # Single button per row if only 1 or 2 answers total, otherwise a 2-column layout
+    keyboard = utils.chunk_buttons(answer_buttons, 1 if len(answers) <= 2 else 2)
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     # Display index starts from 1
-    question_number = game_state['game_length'] - len(game_state['unanswered_indices']) + 1 
+    question_number = game_length - len(unanswered) + 1 
 
     question_text = (
-        f"❓ Question {question_number}/{game_state['game_length']}\n"
-        f"Category: {current_q['category']}\n\n"
-        f"{current_q['question']}"
+        f"❓ Question {question_number}/{game_length}\n"
+        f"Category: {current_q.category}\n\n"
+        f"{current_q.question}"
     )
 
     # --- Send/Edit Message ---
     try:
-        sent_message = await context.bot.send_message(
-            chat_id=chat_id,
-            text=question_text,
-            reply_markup=reply_markup
-        )
-        game_state['last_message_id'] = sent_message.message_id
-        logger.debug(f"Sent question {next_q_index + 1} to user {user_id}")
+        await _show_in_quiz_message(context, chat_id, game_state, question_text, reply_markup)
+        logger.debug("Sent question %s to user %s", next_q_index + 1, user_id)
 
     except Exception as e:
         logger.error(f"Failed to send question {next_q_index + 1} to user {user_id}: {e}")
@@ -219,14 +298,15 @@ async def handle_send_next_question(update: Update, context: ContextTypes.DEFAUL
 
     # --- Set Timeout for the New Question ---
     # Cancel previous timeout task if it exists and hasn't finished
-    if game_state.get('timeout_task') and not game_state['timeout_task'].done():
-        game_state['timeout_task'].cancel()
-        logger.debug(f"Previous timeout task cancelled for user {user_id}.")
+    timeout_task = game_state.timeout_task
+    if timeout_task and not timeout_task.done():
+        timeout_task.cancel()
+        logger.debug("Previous timeout task cancelled for user %s.", user_id)
 
-    game_state['timeout_task'] = asyncio.create_task(
+    game_state.timeout_task = asyncio.create_task(
         _set_question_timeout(update, context, user_id, bot)
     )
-    logger.debug(f"Timeout task created for user {user_id}, Q{next_q_index + 1}.")
+    logger.debug("Timeout task created for user %s, Q%s.", user_id, next_q_index + 1)
 
 
 async def handle_answer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, bot: 'TriviaBot') -> None:
@@ -240,16 +320,20 @@ async def handle_answer_callback(update: Update, context: ContextTypes.DEFAULT_T
 
     user_id = query.from_user.id
 
-    if user_id not in bot.current_games:
+    game_state = bot.current_games.get(user_id)
+    if game_state is None:
         logger.warning(f"User {user_id} answered, but no active game found.")
+        return
 
-
-    game_state = bot.current_games[user_id]
+    questions = game_state.questions
+    unanswered = game_state.unanswered_indices
+    current_idx = game_state.current_question_index
+    timeout_task = game_state.timeout_task
 
     # --- Cancel Timeout ---
-    if game_state.get('timeout_task') and not game_state['timeout_task'].done():
-        game_state['timeout_task'].cancel()
-        logger.debug(f"Timeout task cancelled due to answer from user {user_id}.")
+    if timeout_task and not timeout_task.done():
+        timeout_task.cancel()
+        logger.debug("Timeout task cancelled due to answer from user %s.", user_id)
 
     # --- Parse Callback Data ---
     try:
@@ -262,43 +346,43 @@ async def handle_answer_callback(update: Update, context: ContextTypes.DEFAULT_T
 
     # --- Validate Answer Attempt ---
     # Check if the answered question is the *current* one expected
-    if question_index != game_state.get('current_question_index'):
-         logger.warning(f"User {user_id} answered Q{question_index+1}, but current is {game_state.get('current_question_index', 'N/A')+1}. Ignoring.")
+    if question_index != current_idx:
+         logger.warning(f"User {user_id} answered Q{question_index+1}, but current is {current_idx + 1}. Ignoring.")
          return # Ignore answer for old/future question
 
     # Check if already answered (e.g., double-click)
-    if question_index >= len(game_state['questions']) or game_state['questions'][question_index]['answered']:
-        logger.debug(f"User {user_id} tried to answer Q{question_index+1} which is already answered.")
+    if question_index >= len(questions) or questions[question_index].answered:
+        logger.debug("User %s tried to answer Q%s which is already answered.", user_id, question_index + 1)
         await query.answer("Already answered!")
         return
 
     # --- Process Answer ---
-    current_q = game_state['questions'][question_index]
-    selected_answer = current_q['answers'][answer_index]
-    is_correct = (selected_answer == current_q['correct_answer'])
+    current_q = questions[question_index]
+    selected_answer = current_q.answers[answer_index]
+    is_correct = (selected_answer == current_q.correct_answer)
 
-    current_q['answered'] = True # Mark as answered
+    current_q.answered = True # Mark as answered
     
     # Remove from unanswered list - safety check
-    if question_index in game_state.get('unanswered_indices', []):
-        game_state['unanswered_indices'].remove(question_index)
+    if question_index in unanswered:
+        unanswered.remove(question_index)
     else:
          logger.warning(f"Index {question_index} was not in unanswered list for user {user_id} when answering.")
 
 
     result_icon = "✅" if is_correct else "❌"
     if is_correct:
-        game_state['score'] += 1
+        game_state.score += 1
         result_text = "Correct!"
         logger.info(f"User {user_id} answered Q{question_index + 1} correctly.")
     else:
-        result_text = f"Wrong! Correct was: {current_q['correct_answer']}"
+        result_text = f"Wrong! Correct was: {current_q.correct_answer}"
         logger.info(f"User {user_id} answered Q{question_index + 1} incorrectly.")
 
     # --- Provide Feedback ---
     feedback_text = (
         f"{result_icon} {result_text}\n"
-        f"Score: {game_state['score']}/{game_state['game_length']}"
+        f"Score: {game_state.score}/{game_state.game_length}"
     )
     
     # Edit the question message to show the result and disable the keyboard
@@ -333,59 +417,41 @@ async def handle_end_game(update: Update, context: ContextTypes.DEFAULT_TYPE, bo
         return
 
     game_state = bot.current_games[user_id]
-    logger.info(f"Ending game for user {user_id}. Final Score: {game_state['score']}/{game_state['game_length']}")
+    logger.info(f"Ending game for user {user_id}. Final Score: {game_state.score}/{game_state.game_length}")
 
-    # --- Best Score Logic ---
     # --- Best Score Logic (USER-SPECIFIC) ---
-    current_score = game_state['score']
+    current_score = game_state.score
     game_key = utils.get_best_score_key(
-        game_state['difficulty'], game_state['category'], game_state['game_length']
+        game_state.difficulty, game_state.category, game_state.game_length
     )
 
-    # Get the dictionary of scores for *this specific user*
-    # If the user isn't in best_scores yet, default to an empty dictionary
-    user_best_scores = bot.best_scores.get(user_id, {})
-
-    # Get the previous best score for *this user* and *this game configuration*
-    # If no previous score exists for this config, default to 0
-    previous_best_score = user_best_scores.get(game_key, 0)
-
-
-
-
-
-    # best_score_key = utils.get_best_score_key(
-    #     game_state['difficulty'], game_state['category'], game_state['game_length']
-    # )
-    # previous_best_score = bot.best_scores.get(best_score_key, 0)
-    # current_score = game_state['score']
-    
     congratulations = ""
-    new_best = False
-    if current_score > previous_best_score:
-        # Ensure the user's entry exists in the main dictionary
-        if user_id not in bot.best_scores:
-            bot.best_scores[user_id] = {}
-        # Update the score for this user and game configuration
-        bot.best_scores[user_id][game_key] = current_score
-        new_best = True
-        # Pass the entire best_scores dictionary (now potentially updated) to save
-        utils.save_best_scores(bot.best_scores, bot.best_scores_file)
+    if game_state.truncated:
+        # A cut-short game doesn't count toward the best score for the chosen length
+        congratulations = (
+            f"⚠️ The quiz was cut short: only {len(game_state.questions)} of {game_state.game_length} "
+            "questions could be fetched, so this score doesn't count toward your best score.\n"
+        )
+        best_score_display = await asyncio.to_thread(bot.scores_store.get_best, user_id, game_key)
+    # The store only keeps the score if it beats this user's previous best for this game configuration.
+    # Database calls run in a worker thread so disk I/O doesn't stall other users' games.
+    elif current_score > 0 and await asyncio.to_thread(bot.scores_store.update, user_id, game_key, current_score):
+        best_score_display = current_score
         congratulations = f"🎉 New Personal Best for this setup ({current_score} points)! 🎉\n"
         logger.info(f"User {user_id} achieved new best score for key '{game_key}': {current_score}")
-
-    # Determine the score to display (either the new best or the existing one)
-    # Safely get the potentially updated score
-    best_score_display = bot.best_scores.get(user_id, {}).get(game_key, 0)
+    else:
+        best_score_display = await asyncio.to_thread(bot.scores_store.get_best, user_id, game_key)
 
     # --- Send Final Message ---
+    # A cut-short game played every question it fetched
+    questions_played = len(game_state.questions) if game_state.truncated else game_state.game_length
     final_text = (
         f"🏁 Quiz Finished! 🏁\n\n"
         f"{congratulations}"
-        f"Your final score: {current_score}/{game_state['game_length']}\n"
+        f"Your final score: {current_score}/{questions_played}\n"
         f"Your best score for this setup: {best_score_display}\n\n"
-        f"Difficulty: {game_state['difficulty'].capitalize()}\n"
-        f"Category: {game_state['category_name']}\n\n"
+        f"Difficulty: {game_state.difficulty.capitalize()}\n"
+        f"Category: {game_state.category_name}\n\n"
         "Use /start_quiz to play again!"
     )
 
@@ -396,9 +462,11 @@ async def handle_end_game(update: Update, context: ContextTypes.DEFAULT_TYPE, bo
         logger.error(f"Failed to send final score message to user {user_id}: {e}")
 
     # --- Clean Up ---
-    # Cancel timeout task just in case it's still pending somehow
-    if game_state.get('timeout_task') and not game_state['timeout_task'].done():
-        game_state['timeout_task'].cancel()
+    # Cancel timeout and prefetch tasks just in case they're still pending somehow
+    if game_state.timeout_task and not game_state.timeout_task.done():
+        game_state.timeout_task.cancel()
+    if game_state.prefetch_task and not game_state.prefetch_task.done():
+        game_state.prefetch_task.cancel()
     
     del bot.current_games[user_id] # Remove game state from memory
     logger.info(f"Game state cleaned up for user {user_id}.")
@@ -48,9 +48,11 @@ async def handle_stop_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE, b
         game_state = bot.current_games[user_id]
         
         # Cancel any pending timeout task for this game
-        if game_state.get('timeout_task'):
-            game_state['timeout_task'].cancel()
+        if game_state.timeout_task:
+            game_state.timeout_task.cancel()
             logger.info(f"Timeout task cancelled for user {user_id} via /stop_quiz.")
+        if game_state.prefetch_task:
+            game_state.prefetch_task.cancel()
         
         # Remove the game state
         del bot.current_games[user_id]
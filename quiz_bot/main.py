@@ -7,7 +7,6 @@ from telegram.ext import (
     CommandHandler,
     CallbackQueryHandler,
     ContextTypes,
-    ConversationHandler,
     Defaults,
 )
 
@@ -28,37 +27,24 @@ def main() -> None:
     bot_instance = TriviaBot(token=config.TELEGRAM_BOT_TOKEN)
     
     # --- Create Application ---
-    application = ApplicationBuilder().token(bot_instance.token).build()
-
-    # --- Conversation Handler for Quiz Setup ---
-    conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start_quiz", bot_instance.start_conversation)],
-        states={
-            config.DIFFICULTY_SELECTION: [
-                CallbackQueryHandler(bot_instance.select_difficulty_callback, pattern=r'^difficulty_')
-            ],
-            config.CATEGORY_SELECTION: [
-                CallbackQueryHandler(bot_instance.select_category_callback, pattern=r'^category_')
-            ]
-        },
-        fallbacks=[
-             CommandHandler("cancel", bot_instance.cancel_conversation),
-        ],
+    application = (
+        ApplicationBuilder()
+        .token(bot_instance.token)
+        .post_init(bot_instance.post_init)
+        .post_shutdown(bot_instance.post_shutdown)
+        .build()
     )
 
     # --- Register Handlers ---
-    application.add_handler(conv_handler)
-
-    # Callback handler for selecting game length (triggers quiz start)
-    application.add_handler(CallbackQueryHandler(bot_instance.start_quiz_callback, pattern=r'^length_'))
-    
-    # Callback handler for answering questions
-    application.add_handler(CallbackQueryHandler(bot_instance.answer_callback, pattern=r'^ans_'))
-
     # Command handlers
+    application.add_handler(CommandHandler("start_quiz", bot_instance.start_conversation))
+    application.add_handler(CommandHandler("cancel", bot_instance.cancel_conversation))
     application.add_handler(CommandHandler(["help", "start"], bot_instance.help_command))
     application.add_handler(CommandHandler("stop_quiz", bot_instance.stop_quiz_command))
 
+    # Single callback handler for all inline buttons (setup choices, game length, answers)
+    application.add_handler(CallbackQueryHandler(bot_instance.dispatch_callback))
+
 
     # --- Start the Bot ---
     logger.info("Starting bot polling...")
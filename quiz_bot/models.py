@@ -0,0 +1,31 @@
+import asyncio
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+@dataclass(slots=True)
+class TriviaQuestion:
+    """A processed Open Trivia DB question, with HTML entities decoded and answers shuffled."""
+    question: str
+    answers: List[str]
+    correct_answer: str
+    category: str
+    answered: bool = False
+
+
+@dataclass(slots=True)
+class GameState:
+    """State of a single user's active quiz, stored in TriviaBot.current_games."""
+    difficulty: str
+    category: int
+    category_name: str # Stored for the end-of-game message
+    game_length: int
+    questions: List[TriviaQuestion]
+    unanswered_indices: List[int] # Indices of questions yet to be asked/answered
+    current_question_index: int = 0
+    score: int = 0
+    timeout_task: Optional[asyncio.Task] = None
+    prefetch_task: Optional[asyncio.Task] = None # Background fetch of the remaining questions
+    quiz_message_id: Optional[int] = None # Single message edited in place for every question
+    session_token: Optional[str] = None # Open Trivia DB token so later batches don't repeat questions
+    truncated: bool = False # Set when fewer than game_length questions could be fetched
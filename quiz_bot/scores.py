@@ -0,0 +1,83 @@
+import logging
+import sqlite3
+import threading
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Inserts a score, or replaces the existing one only if the new score is higher
+_UPSERT_BEST_SCORE = '''
+    INSERT INTO scores (user_id, game_key, score) VALUES (?, ?, ?)
+    ON CONFLICT(user_id, game_key) DO UPDATE SET score = excluded.score
+    WHERE excluded.score > scores.score
+'''
+
+def _encode_game_key(game_key: Tuple[str, int, int]) -> str:
+    """Joins a utils.get_best_score_key() tuple into the 'difficulty|category|length' column value."""
+    return "|".join(map(str, game_key))
+
+class BestScoresStore:
+    """
+    User-specific best scores persisted in SQLite, one row per (user_id, game_key).
+    A new best score is a single upsert instead of a rewrite of every user's scores.
+    Methods may be called from worker threads (asyncio.to_thread); a lock serializes use of the connection.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        try:
+            # WAL lets readers proceed while a score is being written
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            with self._conn:
+                self._conn.execute('''
+                    CREATE TABLE IF NOT EXISTS scores (
+                        user_id INTEGER NOT NULL,
+                        game_key TEXT NOT NULL,
+                        score INTEGER NOT NULL,
+                        PRIMARY KEY (user_id, game_key)
+                    )
+                ''')
+        except sqlite3.Error as e:
+            logger.error(f"Failed to initialize best scores database '{db_path}': {e}")
+            self._conn.close()
+            raise
+
+    def is_empty(self) -> bool:
+        """Returns True if no best score has been stored yet."""
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM scores LIMIT 1').fetchone() is None
+
+    def get_best(self, user_id: int, game_key: Tuple[str, int, int]) -> int:
+        """Returns the user's best score for a game configuration, or 0 if there is none."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT score FROM scores WHERE user_id = ? AND game_key = ?',
+                (user_id, _encode_game_key(game_key))
+            ).fetchone()
+        return row[0] if row else 0
+
+    def update(self, user_id: int, game_key: Tuple[str, int, int], score: int) -> bool:
+        """
+        Stores the score if it beats the user's previous best for this game configuration.
+        Returns True if it was stored as a new best.
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(_UPSERT_BEST_SCORE, (user_id, _encode_game_key(game_key), score))
+        return cursor.rowcount > 0
+
+    def import_scores(self, scores: Dict[int, Dict[str, int]]) -> None:
+        """
+        Bulk-loads scores in the legacy JSON layout (user_id -> game_key -> score), keeping the higher score.
+        Legacy game keys are already in the encoded 'difficulty|category|length' form.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(_UPSERT_BEST_SCORE, (
+                (user_id, game_key, score)
+                for user_id, user_scores in scores.items()
+                for game_key, score in user_scores.items()
+            ))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -1,79 +1,137 @@
-import json
+import asyncio
 import logging
 import random
 import html
-from typing import Dict, List, Any
+import time
+from typing import Dict, List, Any, Optional, Tuple
 
-import requests
+import aiohttp
+import orjson
 
 import config
+from models import TriviaQuestion
 
 logger = logging.getLogger(__name__)
 
 # --- Trivia API ---
 
-def fetch_trivia_categories() -> Dict[int, str]:
-    """Fetch available trivia categories from Open Trivia API."""
+def _fast_unescape(text: str) -> str:
+    """html.unescape, skipped for the common case of text without any '&' entity."""
+    return html.unescape(text) if '&' in text else text
+
+# Last successful category fetch as (time.monotonic() timestamp, categories)
+_categories_cache: Optional[Tuple[float, Dict[int, str]]] = None
+
+async def fetch_trivia_categories(session: aiohttp.ClientSession) -> Dict[int, str]:
+    """
+    Fetch available trivia categories from Open Trivia API using the shared HTTP session.
+    Results are cached for config.CATEGORIES_CACHE_TTL seconds; the stale cache is
+    returned (and kept for another TTL) if a refresh fails.
+    """
+    global _categories_cache
+    if _categories_cache and time.monotonic() - _categories_cache[0] < config.CATEGORIES_CACHE_TTL:
+        return _categories_cache[1]
+
     try:
-        response = requests.get(config.TRIVIA_API_CATEGORY_URL,
-                                timeout=config.API_REQUEST_TIMEOUT)
-        response.raise_for_status() # Raise an exception for bad status codes
+        async with session.get(config.TRIVIA_API_CATEGORY_URL) as response:
+            response.raise_for_status() # Raise an exception for bad status codes
+            data = orjson.loads(await response.read())
 
-        data = response.json()
         categories = {
-            cat['id']: html.unescape(cat['name']) 
+            cat['id']: _fast_unescape(cat['name']) 
             for cat in data.get('trivia_categories', [])
         }
-        if not categories:
-            logger.warning("No categories fetched from API.")
-        return categories
-    except requests.exceptions.RequestException as e:
+        if categories:
+            _categories_cache = (time.monotonic(), categories)
+            return categories
+        logger.warning("No categories fetched from API.")
+    except asyncio.TimeoutError:
+        logger.error("Timeout error fetching categories.")
+    except aiohttp.ClientError as e:
         logger.error(f"Error fetching categories: {e}")
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         logger.error(f"Error decoding categories JSON: {e}")
+
+    if _categories_cache:
+        _categories_cache = (time.monotonic(), _categories_cache[1])
+        return _categories_cache[1]
     return {} # Return empty dict on error
 
-def fetch_trivia_questions(difficulty: str, category: int, amount: int) -> List[Dict[str, Any]]:
-    """Fetch and process trivia questions from Open Trivia API."""
+async def fetch_session_token(session: aiohttp.ClientSession) -> Optional[str]:
+    """
+    Request an Open Trivia DB session token. Questions fetched with the same token are never
+    repeated, so every batch of a game gets new questions. Returns None on error.
+    """
+    try:
+        async with session.get(config.TRIVIA_API_TOKEN_URL, params={'command': 'request'}) as response:
+            response.raise_for_status()
+            data = orjson.loads(await response.read())
+        if data.get('response_code') == 0 and data.get('token'):
+            return data['token']
+        logger.warning(f"API returned unexpected response code {data.get('response_code')} when requesting a session token.")
+    except asyncio.TimeoutError:
+        logger.error("Timeout error requesting a session token.")
+    except aiohttp.ClientError as e:
+        logger.error(f"Request error requesting a session token: {e}")
+    except orjson.JSONDecodeError as e:
+        logger.error(f"Error decoding session token JSON: {e}")
+    return None
+
+async def fetch_trivia_questions(session: aiohttp.ClientSession, difficulty: str, category: int, amount: int, token: Optional[str] = None) -> List[TriviaQuestion]:
+    """
+    Fetch and process trivia questions from Open Trivia API using the shared HTTP session.
+    Pass a session token from fetch_session_token to avoid questions already served with it.
+    """
     params = {
         'amount': amount,
         'difficulty': difficulty,
         'category': category,
         'type': 'multiple'
     }
+    if token:
+        params['token'] = token
     try:
-
-        response = requests.get(config.TRIVIA_API_QUESTIONS_URL,
-                                params=params,
-                                timeout=config.API_REQUEST_TIMEOUT)
-        response.raise_for_status()
-
-        data = response.json()
+        async with session.get(config.TRIVIA_API_QUESTIONS_URL, params=params) as response:
+            response.raise_for_status()
+            data = orjson.loads(await response.read())
 
         if data.get('response_code') == 0:
+            # Bound once for the loop; a batch usually shares a single category name
+            unescape = _fast_unescape
+            sample = random.sample
+            category_names: Dict[str, str] = {}
             processed_questions = []
             for question_data in data.get('results', []):
-                # Ensure correct_answer is always included in the list before shuffling
-                correct = html.unescape(question_data.get('correct_answer', ''))
-                incorrect = [html.unescape(ans) for ans in question_data.get('incorrect_answers', []) if ans]
-                
+                try:
+                    correct = unescape(question_data['correct_answer'])
+                    question = unescape(question_data['question'])
+                    raw_category = question_data['category']
+                except KeyError as e:
+                    logger.warning(f"Question skipped due to missing field {e}: {question_data.get('question')}")
+                    continue
+
                 # Guard against missing answers
                 if not correct:
-                   logger.warning(f"Question skipped due to missing correct answer: {question_data.get('question')}")
+                   logger.warning(f"Question skipped due to missing correct answer: {question}")
                    continue
 
-                answers = incorrect + [correct]
-                random.shuffle(answers)
-
-                processed_questions.append({
-                    'question': html.unescape(question_data.get('question', 'N/A')),
-                    'answers': answers,
-                    'correct_answer': correct,
-                    'category': html.unescape(question_data.get('category', 'N/A')),
-                    'answered': False
-                })
+                category = category_names.get(raw_category)
+                if category is None:
+                    category = category_names[raw_category] = unescape(raw_category)
+
+                # Ensure correct_answer is always included in the answers being shuffled
+                answers = [unescape(ans) for ans in question_data.get('incorrect_answers', ()) if ans]
+                answers.append(correct)
+                answers = sample(answers, len(answers))
+
+                processed_questions.append(TriviaQuestion(
+                    question=question,
+                    answers=answers,
+                    correct_answer=correct,
+                    category=category
+                ))
             
-            if len(processed_questions) != amount and len(processed_questions) < data.get('results', []):
+            if len(processed_questions) != amount and len(processed_questions) < len(data.get('results', [])):
                  logger.warning(f"Processed {len(processed_questions)} questions, but API returned {len(data.get('results', []))} (requested {amount}). Some might have been skipped.")
             elif len(processed_questions) < amount:
                  logger.warning(f"API returned fewer questions ({len(processed_questions)}) than requested ({amount}) for params: {params}")
@@ -85,6 +143,12 @@ def fetch_trivia_questions(difficulty: str, category: int, amount: int) -> List[
         elif data.get('response_code') == 2:
              logger.warning(f"API Error (Code 2 - Invalid Parameter): Contains an invalid parameter. Params: {params}")
              return []
+        elif data.get('response_code') == 3:
+             logger.warning(f"API Error (Code 3 - Token Not Found): Session token does not exist. Params: {params}")
+             return []
+        elif data.get('response_code') == 4:
+             logger.warning(f"API Error (Code 4 - Token Empty): No unused questions left for this token. Params: {params}")
+             return []
         elif data.get('response_code') == 5:
              logger.warning(f"API Error (Code 5 - Too Many Requests): Rate limit hit. Please wait before requesting more questions.")
 
@@ -93,31 +157,32 @@ def fetch_trivia_questions(difficulty: str, category: int, amount: int) -> List[
             logger.warning(f"API returned unexpected response code: {data.get('response_code')} for params: {params}")
             return [] # Indicate potential issue
 
-    except requests.exceptions.Timeout:
+    except asyncio.TimeoutError:
         logger.error(f"Timeout error fetching questions for params: {params}")
         return []
-    except requests.exceptions.RequestException as e:
+    except aiohttp.ClientError as e:
         logger.error(f"Request error fetching questions: {e}")
         return []
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         logger.error(f"Error decoding questions JSON: {e}")
         return []
     except Exception as e: 
         logger.exception(f"Unexpected error processing trivia questions: {e}")
         return []
 
-# --- Best Score Persistence ---
+# --- Legacy Best Score File ---
 
 def load_best_scores() -> Dict[int, Dict[str, int]]:
     """
-    Load user-specific best scores from the JSON file specified in config.
+    Load user-specific best scores from the legacy JSON file specified in config,
+    used once to import them into the best scores database.
     Keys are user_ids (int), values are dicts mapping game keys (str) to scores (int).
     Handles conversion of user_id keys from string (JSON) to int.
     """
     scores: Dict[int, Dict[str, int]] = {}
     try:
-        with open(config.BEST_SCORES_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(config.BEST_SCORES_FILE, 'rb') as f:
+            data = orjson.loads(f.read())
 
         if not isinstance(data, dict):
             logger.warning(f"'{config.BEST_SCORES_FILE}' does not contain a dictionary. Starting fresh.")
@@ -127,54 +192,42 @@ def load_best_scores() -> Dict[int, Dict[str, int]]:
             try:
                 user_id = int(user_id_str)
                 if isinstance(user_scores, dict):
-                    validated_user_scores: Dict[str, int] = {}
-                    all_valid = True
-                    for game_key, score in user_scores.items():
-                        if isinstance(game_key, str) and isinstance(score, int):
-                             validated_user_scores[game_key] = score
-                        else:
-                             logger.warning(f"Invalid entry in scores for user {user_id}: key='{game_key}' ({type(game_key)}), score='{score}' ({type(score)}). Skipping entry.")
-                             all_valid = False
-                    if all_valid or validated_user_scores: 
+                    validated_user_scores: Dict[str, int] = {
+                        game_key: score for game_key, score in user_scores.items()
+                        if type(game_key) is str and type(score) is int
+                    }
+                    if len(validated_user_scores) != len(user_scores):
+                        # Slow pass only for malformed entries, to log what was skipped
+                        for game_key, score in user_scores.items():
+                            if game_key not in validated_user_scores:
+                                logger.warning(f"Invalid entry in scores for user {user_id}: key='{game_key}' ({type(game_key)}), score='{score}' ({type(score)}). Skipping entry.")
+                    if validated_user_scores or not user_scores:
                          scores[user_id] = validated_user_scores
 
                 else:
                     logger.warning(f"Invalid score data type for user ID '{user_id_str}': Expected dict, got {type(user_scores)}. Skipping user.")
             except ValueError:
                 logger.warning(f"Invalid user ID key '{user_id_str}' found in '{config.BEST_SCORES_FILE}'. Expected integer. Skipping entry.")
-        
+
         return scores
 
     except FileNotFoundError:
-        logger.info(f"'{config.BEST_SCORES_FILE}' not found. Starting with empty scores.")
+        logger.info(f"'{config.BEST_SCORES_FILE}' not found. No legacy best scores to import.")
         return {}
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         logger.error(f"Error decoding JSON from '{config.BEST_SCORES_FILE}': {e}. Starting fresh.")
         return {}
     except Exception as e:
         logger.exception(f"Unexpected error loading best scores from '{config.BEST_SCORES_FILE}': {e}") # Use logger.exception to include traceback
         return {}
 
-def save_best_scores(scores: Dict[int, Dict[str, int]], filepath: str = config.BEST_SCORES_FILE):
-    """
-    Save user-specific best scores to the specified JSON file.
-    Keys are user_ids (int), values are dicts mapping game keys (str) to scores (int).
-    """
-    try:
-
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(scores, f, indent=4, ensure_ascii=False) # Use indent for readability, ensure_ascii=False for broader character support
-        logger.info(f"Successfully saved best scores for {len(scores)} users to '{filepath}'")
-    except TypeError as e:
-         logger.error(f"Data type error saving best scores (potential non-serializable data?): {e}")
-    except IOError as e:
-        logger.error(f"I/O error writing best scores to '{filepath}': {e}")
-    except Exception as e:
-        logger.exception(f"Unexpected error saving best scores to '{filepath}': {e}")
-
 
 # --- Helpers ---
 
-def get_best_score_key(difficulty: str, category_id: int, game_length: int) -> str:
+def chunk_buttons(buttons: List[Any], cols: int) -> List[List[Any]]:
+    """Split a flat list of keyboard buttons into rows of at most `cols` buttons."""
+    return [buttons[i:i + cols] for i in range(0, len(buttons), cols)]
+
+def get_best_score_key(difficulty: str, category_id: int, game_length: int) -> Tuple[str, int, int]:
     """Generate a unique key for best score tracking based on game parameters."""
-    return f"{difficulty.lower()}|{category_id}|{game_length}"
+    return (difficulty.lower(), category_id, game_length)
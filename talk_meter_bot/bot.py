@@ -1,6 +1,8 @@
 import asyncio
+import logging
 import os
-from datetime import datetime, timedelta
+import time
+from collections import OrderedDict, deque
 
 from dotenv import load_dotenv
 
@@ -14,7 +16,12 @@ from telegram.ext import (
 
 from config import (
     DATABASE_PATH, 
+    MESSAGE_BATCH_SIZE,
+    MESSAGE_FLUSH_INTERVAL,
+    MESSAGE_ARCHIVE_INTERVAL,
+    LEADERBOARD_REFRESH_INTERVAL,
     SPAM_THRESHOLD,
+    SPAM_TRACKER_MAX_USERS,
     PERIODS,
     NOTIFICATION_INTERVAL
 )
@@ -22,12 +29,38 @@ from database import DatabaseManager
 from leaderboard import LeaderboardManager
 from notifications import NotificationManager
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
+class MessageTracker(OrderedDict):
+    """
+    Per-user spam-window timestamps, evicting the least recently active user beyond maxsize.
+    Reading an unknown user creates their empty deque, like a defaultdict(deque).
+    """
+    def __init__(self, maxsize):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+
+    def __missing__(self, key):
+        value = self[key] = deque()
+        return value
+
 class LeaderboardBot:
     def __init__(self):
         # Initialize database
-        self.db_manager = DatabaseManager(DATABASE_PATH)
+        self.db_manager = DatabaseManager(DATABASE_PATH, MESSAGE_BATCH_SIZE)
         
         # Initialize leaderboard manager
         self.leaderboard_manager = LeaderboardManager(self.db_manager)
@@ -36,8 +69,11 @@ class LeaderboardBot:
         TELEGRAM_BOT_TOKEN = os.getenv("TALK_METER")
         self.application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
         
-        # Message tracking
-        self.user_message_track = {}
+        # Message tracking (bounded so users who stopped messaging don't accumulate forever)
+        self.user_message_track = MessageTracker(SPAM_TRACKER_MAX_USERS)
+        # Spam limits bound once, instead of a dict lookup per message
+        self._spam_window = SPAM_THRESHOLD['time_window']
+        self._spam_max = SPAM_THRESHOLD['messages']
 
     def setup_handlers(self):
         """Set up command and message handlers."""
@@ -91,31 +127,29 @@ class LeaderboardBot:
         """Handle incoming messages with spam protection."""
         user = update.effective_user
         chat = update.effective_chat
-        current_time = datetime.now()
+        current_time = time.monotonic()
 
         # Only process messages from group chats
         if not chat or chat.type not in ['group', 'supergroup']:
             return
         
-        # Initialize or update user tracking
-        if user.id not in self.user_message_track:
-            self.user_message_track[user.id] = []
-        
-        # Remove old messages from tracking
-        self.user_message_track[user.id] = [
-            msg_time for msg_time in self.user_message_track[user.id]
-            if (current_time - msg_time).total_seconds() <= SPAM_THRESHOLD['time_window']
-        ]
+        # Drop messages that fell out of the spam window (oldest monotonic timestamps are on the left);
+        # a user's first message creates their tracking deque
+        recent_messages = self.user_message_track[user.id]
+        cutoff = current_time - self._spam_window
+        while recent_messages and recent_messages[0] < cutoff:
+            recent_messages.popleft()
         
         # Check spam
-        if len(self.user_message_track[user.id]) >= SPAM_THRESHOLD['messages']:
+        if len(recent_messages) >= self._spam_max:
             return  # Ignore spam
         
         # Track message
-        self.user_message_track[user.id].append(current_time)
+        recent_messages.append(current_time)
         
         # Process message for leaderboard and milestones
-        milestones = self.leaderboard_manager.process_message(
+        milestones = await self.db_manager.run_async(
+            self.leaderboard_manager.process_message,
             user.id, 
             user.username or user.first_name
         )
@@ -131,15 +165,17 @@ class LeaderboardBot:
 
     async def rank_command(self, update: Update, context):
         """Show all-time leaderboard."""
-        message = self.leaderboard_manager.get_leaderboard_message(
-            'all-time', 
+        message = await self.db_manager.run_async(
+            self.leaderboard_manager.get_leaderboard_message,
+            'all_time', 
             update.effective_user.id
         )
         await update.message.reply_text(text=message, parse_mode='Markdown')
 
     async def dailyrank_command(self, update: Update, context):
         """Show daily leaderboard."""
-        message = self.leaderboard_manager.get_leaderboard_message(
+        message = await self.db_manager.run_async(
+            self.leaderboard_manager.get_leaderboard_message,
             'daily', 
             update.effective_user.id
         )
@@ -147,7 +183,8 @@ class LeaderboardBot:
 
     async def weeklyrank_command(self, update: Update, context):
         """Show weekly leaderboard."""
-        message = self.leaderboard_manager.get_leaderboard_message(
+        message = await self.db_manager.run_async(
+            self.leaderboard_manager.get_leaderboard_message,
             'weekly', 
             update.effective_user.id
         )
@@ -155,7 +192,8 @@ class LeaderboardBot:
 
     async def monthlyrank_command(self, update: Update, context):
         """Show monthly leaderboard."""
-        message = self.leaderboard_manager.get_leaderboard_message(
+        message = await self.db_manager.run_async(
+            self.leaderboard_manager.get_leaderboard_message,
             'monthly', 
             update.effective_user.id
         )
@@ -163,18 +201,21 @@ class LeaderboardBot:
 
     async def mystats_command(self, update: Update, context):
         """Show user's personal stats."""
-        message = self.leaderboard_manager.get_user_stats(update.effective_user.id)
+        message = await self.db_manager.run_async(
+            self.leaderboard_manager.get_user_stats,
+            update.effective_user.id
+        )
         await update.message.reply_text(message)
 
     async def notifyme_command(self, update: Update, context):
         """Enable leaderboard notifications."""
-        print("notifyme_command turned on")
-        self.db_manager.toggle_notifications(update.effective_user.id, True)
+        logger.info("User %s turned on notifications", update.effective_user.id)
+        await self.db_manager.run_async(self.db_manager.toggle_notifications, update.effective_user.id, True)
         await update.message.reply_text("You will now receive leaderboard update notifications.")
 
     async def stopnotify_command(self, update: Update, context):
         """Disable leaderboard notifications."""
-        self.db_manager.toggle_notifications(update.effective_user.id, False)
+        await self.db_manager.run_async(self.db_manager.toggle_notifications, update.effective_user.id, False)
         await update.message.reply_text("You will no longer receive leaderboard update notifications.")
 
     async def start_periodic_checks(self):
@@ -183,10 +224,36 @@ class LeaderboardBot:
             if period != 'alltime':
                 await self.notification_manager.check_leaderboard_changes(period)
 
+    async def flush_messages_job(self, context):
+        """Write buffered messages on the database worker thread."""
+        await self.db_manager.run_async(self.db_manager.flush_messages)
+
+    async def refresh_leaderboards_job(self, context):
+        """Rebuild the precomputed leaderboards on the database worker thread."""
+        await self.db_manager.run_async(self.db_manager.refresh_leaderboards)
+
+    async def archive_messages_job(self, context):
+        """Archive messages older than the monthly leaderboard on the database worker thread."""
+        await self.db_manager.run_async(self.db_manager.archive_old_messages)
+
     def run(self):
         """Run the bot."""
         self.setup_handlers()
         
+        # Move old messages out of the table the period leaderboards scan
+        self.application.job_queue.run_repeating(
+            self.archive_messages_job,
+            interval=MESSAGE_ARCHIVE_INTERVAL,
+            first=0
+        )
+        
+        # Rebuild leaderboards first so the periodic checks below see current data
+        self.db_manager.refresh_leaderboards()
+        self.application.job_queue.run_repeating(
+            self.refresh_leaderboards_job,
+            interval=LEADERBOARD_REFRESH_INTERVAL
+        )
+        
         # Run periodic checks
         self.application.job_queue.run_repeating(
             lambda context: asyncio.create_task(self.start_periodic_checks()), 
@@ -194,10 +261,24 @@ class LeaderboardBot:
             first=0
         )
         
+        # Write buffered messages regularly, even when batches stay small
+        self.application.job_queue.run_repeating(
+            self.flush_messages_job,
+            interval=MESSAGE_FLUSH_INTERVAL
+        )
+        
         # Start the Bot
-        self.application.run_polling(drop_pending_updates=True)
+        try:
+            self.application.run_polling(drop_pending_updates=True)
+        finally:
+            self.db_manager.close()
 
 def main():
+    # Configure logging to track bot and database events and errors
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
     bot = LeaderboardBot()
     bot.run()
 
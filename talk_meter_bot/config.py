@@ -1,14 +1,31 @@
 # Database Configuration
 DATABASE_PATH = "leaderboard.db"
+# Logged messages are buffered and written together once this many are pending...
+MESSAGE_BATCH_SIZE = 500
+# ...or at least this often (seconds)
+MESSAGE_FLUSH_INTERVAL = 1
+# Maximum number of users whose running message totals are kept in memory
+MESSAGE_TOTALS_MAX_USERS = 10000
+# Seconds between runs moving messages older than the monthly leaderboard window to the archive table (1 day)
+MESSAGE_ARCHIVE_INTERVAL = 24 * 60 * 60
 
 # Leaderboard Settings
 MILESTONES = [1000, 5000, 10000]
+MILESTONES_SET = frozenset(MILESTONES)  # For O(1) membership checks per message
+# Seconds a rendered daily/weekly/monthly leaderboard is reused before it is rebuilt from the database
+LEADERBOARD_CACHE_SECONDS = 10
+# Seconds between rebuilds of the precomputed leaderboard tables
+LEADERBOARD_REFRESH_INTERVAL = 60
+# Seconds a daily/weekly/monthly leaderboard query result is reused (cleared earlier by a refresh or archive run)
+LEADERBOARD_QUERY_CACHE_TTL = 30
 
 # Anti-Spam Configuration
 SPAM_THRESHOLD = {
     "messages": 5,  # Maximum number of messages
     "time_window": 10,  # Time window in seconds
 }
+# Maximum number of users whose recent message times are kept for spam checks
+SPAM_TRACKER_MAX_USERS = 10000
 
 # Leaderboard Periods
 PERIODS = {
@@ -21,6 +38,9 @@ PERIODS = {
 # Notification Settings
 MAX_NOTIFICATION_USERS = 1000  # Limit notifications to prevent excessive load
 NOTIFICATION_INTERVAL = 60 * 60   # 1 hour in seconds
+NOTIFICATION_SEND_CONCURRENCY = 20  # Notifications sent to Telegram at the same time
+NOTIFICATION_SEND_ATTEMPTS = 3  # Tries per notification when Telegram asks to retry later (RetryAfter)
+NOTIFICATION_USERS_CACHE_TTL = 300  # Seconds the subscriber list is reused (cleared on any subscription change)
 
 
 
@@ -1,43 +1,165 @@
+import asyncio
 import logging
 import sqlite3
-from datetime import datetime, timedelta
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from typing import List, Tuple, Optional, Dict, Any
 
+from cachetools import LRUCache, TTLCache
+
+from config import LEADERBOARD_QUERY_CACHE_TTL, MESSAGE_TOTALS_MAX_USERS, NOTIFICATION_USERS_CACHE_TTL
+
+# Per-connection settings: fewer fsyncs per commit, temp tables in memory,
+# 256 MB memory-mapped reads and a 64 MB page cache
+_CONNECTION_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-65536',
+)
+
+# Hot-path statements, kept as constants so the connection's statement cache reuses them
+_SQL_UPSERT_USER = '''
+    INSERT INTO users (
+        user_id, 
+        username, 
+        total_messages, 
+        last_message_time
+    ) VALUES (?, ?, 1, ?)
+    ON CONFLICT(user_id) DO UPDATE SET 
+        total_messages = total_messages + 1,
+        last_message_time = excluded.last_message_time
+'''
+_SQL_INSERT_MESSAGE = 'INSERT INTO messages (user_id, timestamp) VALUES (?, ?)'
+
+# Precomputed leaderboard table per period, rebuilt by refresh_leaderboards.
+# The all-time leaderboard is read straight from the users table's running totals.
+_LEADERBOARD_TABLES = {
+    'daily': 'leaderboard_daily',
+    'weekly': 'leaderboard_weekly',
+    'monthly': 'leaderboard_monthly'
+}
+
+# Message log filter for each precomputed period
+_PERIOD_FILTERS = {
+    'daily': 'WHERE m.timestamp >= date("now", "-1 day")',
+    'weekly': 'WHERE m.timestamp >= date("now", "-7 days")',
+    'monthly': 'WHERE m.timestamp >= date("now", "-1 month")'
+}
+
+# Start of the widest period window above (monthly). Messages before it are archived;
+# this must stay the same expression as the widest filter, or archiving drops counted messages.
+_SQL_ARCHIVE_CUTOFF = 'SELECT date("now", "-1 month")'
+
+# All-time leaderboard source, read from the users table's running totals
+_ALL_TIME_SOURCE = '''
+    SELECT 
+        user_id, 
+        username, 
+        total_messages AS message_count, 
+        last_message_time AS last_count_time  -- When the user reached their count
+    FROM users
+'''
+
+# A user's total, highest rank and current rank in every period, in one query;
+# ranks use the same order as the leaderboards
+_SQL_USER_FULL_STATS = '''
+    WITH ranked_users AS (
+        SELECT 'daily' AS period, user_id, ROW_NUMBER() OVER (
+            ORDER BY message_count DESC, last_count_time ASC
+        ) AS final_rank
+        FROM leaderboard_daily
+        UNION ALL
+        SELECT 'weekly', user_id, ROW_NUMBER() OVER (
+            ORDER BY message_count DESC, last_count_time ASC
+        )
+        FROM leaderboard_weekly
+        UNION ALL
+        SELECT 'monthly', user_id, ROW_NUMBER() OVER (
+            ORDER BY message_count DESC, last_count_time ASC
+        )
+        FROM leaderboard_monthly
+        UNION ALL
+        SELECT 'all_time', user_id, ROW_NUMBER() OVER (
+            ORDER BY total_messages DESC, last_message_time ASC
+        )
+        FROM users
+    )
+    SELECT 
+        u.total_messages, 
+        u.highest_rank, 
+        MAX(CASE WHEN r.period = 'daily' THEN r.final_rank END) AS daily_rank, 
+        MAX(CASE WHEN r.period = 'weekly' THEN r.final_rank END) AS weekly_rank, 
+        MAX(CASE WHEN r.period = 'monthly' THEN r.final_rank END) AS monthly_rank, 
+        MAX(CASE WHEN r.period = 'all_time' THEN r.final_rank END) AS all_time_rank
+    FROM users u
+    LEFT JOIN ranked_users r ON r.user_id = u.user_id
+    WHERE u.user_id = ?
+    GROUP BY u.user_id
+'''
+
 class DatabaseManager:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, batch_size: int = 500):
         """
         Initialize the database manager with logging and error handling.
         
         :param db_path: Path to the SQLite database file
+        :param batch_size: Number of buffered messages that triggers a write
         """
         self.db_path = db_path
+        self.batch_size = batch_size
+        
+        # Logged messages as (user_id, username, timestamp), written in one transaction by flush_messages
+        self._pending: List[Tuple[int, str, str]] = []
+        # Running all-time message totals (including buffered messages) for recently active users,
+        # loaded per user on first message; an evicted user is reloaded from users.total_messages
+        self._totals: LRUCache = LRUCache(maxsize=MESSAGE_TOTALS_MAX_USERS)
         
-        # Configure logging to track database events and errors
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
         self.logger = logging.getLogger(__name__)
         
+        # One connection is opened up front and reused by every query;
+        # the lock keeps threads from interleaving statements on it
+        self._lock = threading.Lock()
+        # Recent query results: period leaderboards keyed by (period, limit), subscribers keyed by limit;
+        # cleared whenever the underlying tables change
+        self._leaderboard_cache: TTLCache = TTLCache(maxsize=16, ttl=LEADERBOARD_QUERY_CACHE_TTL)
+        self._notification_users_cache: TTLCache = TTLCache(maxsize=4, ttl=NOTIFICATION_USERS_CACHE_TTL)
+        # Single worker thread that async callers hand database work to (see run_async)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database')
+        
         # Ensure database is set up by creating necessary tables
         try:
+            self._conn = self._get_connection()
             self._create_tables()
         except Exception as e:
-            self.logger.error(f"Database initialization failed: {e}")
+            self.logger.error("Database initialization failed: %s", e)
             raise
 
+    async def run_async(self, func, *args):
+        """
+        Run a blocking database call on the database worker thread, so commits and
+        fsyncs never stall the event loop. One worker keeps writes serialized.
+        
+        :param func: Callable doing the database work, e.g. self.flush_messages
+        :return: The callable's return value
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
     def _get_connection(self) -> sqlite3.Connection:
         """
-        Create and return a new database connection.
+        Create and return the database connection shared by all queries.
         
         :return: SQLite database connection
         """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
             conn.row_factory = sqlite3.Row # Enables dictionary-like access to row data
+            for pragma in _CONNECTION_PRAGMAS:
+                conn.execute(pragma)
             return conn
         except sqlite3.Error as e:
-            self.logger.error(f"Connection creation failed: {e}")
+            self.logger.error("Connection creation failed: %s", e)
             raise
 
     def _create_tables(self) -> None:
@@ -56,12 +178,18 @@ class DatabaseManager:
                 first_message_time DATETIME DEFAULT CURRENT_TIMESTAMP,
                 UNIQUE(username)
             )''',
-            # Messages table to store individual message logs with timestamps
+            # Messages table to store recent message logs with timestamps (hot data for period leaderboards)
             '''CREATE TABLE IF NOT EXISTS messages (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY(user_id) REFERENCES users(user_id)
+            )''',
+            # Archive of messages older than the longest leaderboard period, moved by archive_old_messages
+            '''CREATE TABLE IF NOT EXISTS messages_archive (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                timestamp DATETIME NOT NULL
             )''',
              # Notifications table to track user subscription status
             '''CREATE TABLE IF NOT EXISTS notifications (
@@ -69,208 +197,284 @@ class DatabaseManager:
                 is_subscribed INTEGER DEFAULT 1 CHECK(is_subscribed IN (0, 1)),
                 subscribed_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )''',
-            # Index for optimizing queries on messages table
-            '''CREATE INDEX IF NOT EXISTS idx_messages_user_timestamp 
-            ON messages(user_id, timestamp)'''
+            # Covering index for period leaderboards: a range scan over recent timestamps
+            # that also yields user_id, so the message rows themselves are never read
+            '''CREATE INDEX IF NOT EXISTS idx_messages_timestamp_user 
+            ON messages(timestamp, user_id)''',
+            # Replaced by idx_messages_timestamp_user; nothing looks messages up by user
+            '''DROP INDEX IF EXISTS idx_messages_user_timestamp''',
+            # Partial index holding only subscribed users, so listing subscribers skips unsubscribed rows
+            '''CREATE INDEX IF NOT EXISTS idx_notif_subscribed 
+            ON notifications(user_id) WHERE is_subscribed = 1''',
+            # Index matching the all-time leaderboard order (last_message_time is when the count was reached)
+            '''CREATE INDEX IF NOT EXISTS idx_users_total 
+            ON users(total_messages DESC, last_message_time ASC)'''
         ]
+        # Leaderboard tables holding each user's message count for the period,
+        # with the time of their last counted message as the tiebreaker
+        for table in _LEADERBOARD_TABLES.values():
+            create_queries.append(f'''CREATE TABLE IF NOT EXISTS {table} (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT NOT NULL,
+                message_count INTEGER NOT NULL,
+                last_count_time DATETIME NOT NULL
+            )''')
+            create_queries.append(f'''CREATE INDEX IF NOT EXISTS idx_{table}_order 
+            ON {table}(message_count DESC, last_count_time ASC)''')
         
         try:
-            with self._get_connection() as conn:
+            with self._lock, self._conn as conn:
+                # WAL is persistent in the database file, so it only needs setting once;
+                # it lets leaderboard reads run while messages are being logged
+                conn.execute('PRAGMA journal_mode=WAL')
                 cursor = conn.cursor()
                 for query in create_queries:
                     cursor.execute(query)
-                conn.commit()
             self.logger.info("Database tables created successfully")
         except sqlite3.Error as e:
-            self.logger.error(f"Error creating tables: {e}")
+            self.logger.error("Error creating tables: %s", e)
             raise
 
-    def log_message(self, user_id: int, username: str) -> None:
+    def log_message(self, user_id: int, username: str) -> int:
         """
-        Log a message for a user, updating user statistics.
+        Buffer a message for a user; buffered messages are written once batch_size
+        is reached, on the periodic flush, or before any statistics query.
         
         :param user_id: Telegram user ID
         :param username: Telegram username
+        :return: The user's all-time message total including this message
         """
-        try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Insert or update user data while tracking total messages sent
-                cursor.execute('''
-                    INSERT INTO users (
-                        user_id, 
-                        username, 
-                        total_messages, 
-                        last_message_time
-                    ) VALUES (?, ?, 1, CURRENT_TIMESTAMP)
-                    ON CONFLICT(user_id) DO UPDATE SET 
-                        total_messages = total_messages + 1,
-                        last_message_time = CURRENT_TIMESTAMP
-                ''', (user_id, username or str(user_id)))
-                
-                # Insert a new message log
-                cursor.execute(
-                    'INSERT INTO messages (user_id) VALUES (?)', 
-                    (user_id,)
-                )
-                
-                conn.commit()
-        except sqlite3.Error as e:
-            self.logger.error(f"Error logging message for user {user_id}: {e}")
+        # Same format as CURRENT_TIMESTAMP, so period filters compare correctly
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            total_messages = self._totals.get(user_id)
+            if total_messages is None:
+                try:
+                    result = self._conn.execute(
+                        'SELECT total_messages FROM users WHERE user_id = ?', (user_id,)
+                    ).fetchone()
+                    total_messages = result[0] if result else 0
+                except sqlite3.Error as e:
+                    self.logger.error("Error loading message total for %s: %s", user_id, e)
+                    total_messages = 0
+            total_messages += 1
+            self._totals[user_id] = total_messages
+            self._pending.append((user_id, username or str(user_id), timestamp))
+            if len(self._pending) < self.batch_size:
+                return total_messages
+        self.flush_messages()
+        return total_messages
 
-    def get_user_stats(self, user_id: int) -> Tuple[int, int]:
+    def flush_messages(self) -> None:
         """
-        Retrieve user's total messages and highest rank.
-        
-        :param user_id: Telegram user ID
-        :return: Tuple of (total_messages, highest_rank)
+        Write all buffered messages and user statistics in a single transaction.
+        """
+        with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            try:
+                with self._conn as conn:
+                    # Insert or update user data while tracking total messages sent
+                    conn.executemany(_SQL_UPSERT_USER, batch)
+                    # Insert the message logs
+                    conn.executemany(_SQL_INSERT_MESSAGE, [(user_id, timestamp) for user_id, _, timestamp in batch])
+            except sqlite3.IntegrityError as e:
+                # One row conflicts (e.g. two users sharing a username), so the batch was rolled back;
+                # write it again row by row so only the conflicting messages are dropped
+                self.logger.warning("Error logging %s messages: %s; retrying one by one", len(batch), e)
+                self._flush_rows(batch)
+            except sqlite3.Error as e:
+                self.logger.error("Error logging %s messages: %s", len(batch), e)
+                # The batch was lost, so reload totals from the database
+                self._totals.clear()
+
+    def _flush_rows(self, batch: List[Tuple[int, str, str]]) -> None:
+        """
+        Write buffered messages in one transaction, each under its own savepoint,
+        skipping any row that violates a constraint. The caller must hold the lock.
         """
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT total_messages, highest_rank 
-                    FROM users 
-                    WHERE user_id = ?
-                ''', (user_id,))
-                
-                result = cursor.fetchone()
-                return (result['total_messages'], result['highest_rank']) if result else (0, None)
+            with self._conn as conn:
+                conn.execute('BEGIN')
+                for user_id, username, timestamp in batch:
+                    conn.execute('SAVEPOINT message_row')
+                    try:
+                        conn.execute(_SQL_UPSERT_USER, (user_id, username, timestamp))
+                        conn.execute(_SQL_INSERT_MESSAGE, (user_id, timestamp))
+                    except sqlite3.IntegrityError as e:
+                        conn.execute('ROLLBACK TO message_row')
+                        self.logger.error("Error logging message for %s: %s", user_id, e)
+                        # This message was not counted, so reload the user's total from the database
+                        self._totals.pop(user_id, None)
+                    conn.execute('RELEASE message_row')
         except sqlite3.Error as e:
-            self.logger.error(f"Error retrieving user stats for {user_id}: {e}")
-            return (0, 0)
+            self.logger.error("Error logging %s messages: %s", len(batch), e)
+            self._totals.clear()
 
-    def get_leaderboard(self, period: str = 'all_time', limit: int = 10) -> List[Tuple[int, str, int]]:
+    def refresh_leaderboards(self) -> None:
         """
-        Generate leaderboard with strict first-to-count priority.
+        Rebuild the precomputed leaderboard tables from the message log
+        and record any improved all-time rank as the user's highest rank.
         """
+        self.flush_messages()
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Period filtering
-                period_filters = {
-                    'daily': 'AND m.timestamp >= date("now", "-1 day")',
-                    'weekly': 'AND m.timestamp >= date("now", "-7 days")',
-                    'monthly': 'AND m.timestamp >= date("now", "-1 month")',
-                    'all_time': ''
-                }
-                
-                query = f'''
-                    WITH user_messages AS (
+            with self._lock, self._conn as conn:
+                for period, table in _LEADERBOARD_TABLES.items():
+                    conn.execute(f'DELETE FROM {table}')
+                    conn.execute(f'''
+                        INSERT INTO {table} (user_id, username, message_count, last_count_time)
                         SELECT 
                             u.user_id, 
                             u.username, 
-                            COUNT(m.id) as message_count,
-                            MAX(m.timestamp) as last_count_time,  -- Changed to last message timestamp
-                            ROW_NUMBER() OVER (
-                                PARTITION BY COUNT(m.id) 
-                                ORDER BY MAX(m.timestamp) ASC  -- Order by earliest timestamp to reach count
-                            ) as message_count_order
+                            COUNT(m.id), 
+                            MAX(m.timestamp)  -- When the user reached their count
                         FROM users u
                         JOIN messages m ON u.user_id = m.user_id
-                        WHERE 1=1 {period_filters.get(period, '')}
+                        {_PERIOD_FILTERS[period]}
                         GROUP BY u.user_id, u.username
-                    )
-                    SELECT 
-                        user_id, 
-                        username, 
-                        message_count
-                    FROM user_messages
-                    ORDER BY 
-                        message_count DESC, 
-                        last_count_time ASC  -- Tiebreaker: who reached the count first
-                    LIMIT ?
-                '''
-                
-                cursor.execute(query, (limit,))
-                return [
-                    (row['user_id'], row['username'], row['message_count']) 
-                    for row in cursor.fetchall()
-                ]
+                    ''')
+                # Update highest ranks for every user at once rather than per message
+                conn.execute('''
+                    UPDATE users 
+                    SET highest_rank = ranked_users.final_rank
+                    FROM (
+                        SELECT 
+                            user_id, 
+                            ROW_NUMBER() OVER (
+                                ORDER BY total_messages DESC, last_message_time ASC
+                            ) AS final_rank
+                        FROM users
+                    ) AS ranked_users
+                    WHERE users.user_id = ranked_users.user_id
+                    AND (users.highest_rank IS NULL OR ranked_users.final_rank < users.highest_rank)
+                ''')
+        except sqlite3.Error as e:
+            self.logger.error("Error refreshing leaderboards: %s", e)
+        self._leaderboard_cache.clear()
+
+    def archive_old_messages(self) -> None:
+        """
+        Move messages older than the monthly leaderboard window from the messages table
+        to messages_archive, keeping the table scanned by the period leaderboards small.
+        All-time counts are unaffected; they come from users.total_messages.
+        """
+        self.flush_messages()
+        try:
+            with self._lock, self._conn as conn:
+                # Evaluated once so both statements move exactly the same rows
+                cutoff = conn.execute(_SQL_ARCHIVE_CUTOFF).fetchone()[0]
+                conn.execute('''
+                    INSERT INTO messages_archive (id, user_id, timestamp)
+                    SELECT id, user_id, timestamp FROM messages WHERE timestamp < ?
+                ''', (cutoff,))
+                cursor = conn.execute('DELETE FROM messages WHERE timestamp < ?', (cutoff,))
+            self.logger.info("Archived %s messages from before %s", cursor.rowcount, cutoff)
+            self._leaderboard_cache.clear()
+        except sqlite3.Error as e:
+            self.logger.error("Error archiving old messages: %s", e)
+
+    def _leaderboard_source(self, period: str) -> str:
+        """
+        Return a subquery of (user_id, username, message_count, last_count_time) for a period.
+        Periods are served from their precomputed table; anything else uses the all-time totals.
+        """
+        table = _LEADERBOARD_TABLES.get(period)
+        if table:
+            return f'SELECT user_id, username, message_count, last_count_time FROM {table}'
+        # All-time totals are kept up to date on every flush
+        self.flush_messages()
+        return _ALL_TIME_SOURCE
+
+    def get_leaderboard(self, period: str = 'all_time', limit: int = 10) -> List[Tuple[int, str, int]]:
+        """
+        Read the top of a leaderboard with strict first-to-count priority.
+        Period results are reused for LEADERBOARD_QUERY_CACHE_TTL seconds or until the next refresh;
+        the all-time board changes on every flush, so it is always read live to match get_user_rank.
+        """
+        cache_key = (period, limit)
+        cacheable = period in _LEADERBOARD_TABLES
+        if cacheable:
+            leaderboard = self._leaderboard_cache.get(cache_key)
+            if leaderboard is not None:
+                return leaderboard
+        
+        query = f'''
+            SELECT 
+                user_id, 
+                username, 
+                message_count
+            FROM ({self._leaderboard_source(period)})
+            ORDER BY 
+                message_count DESC, 
+                last_count_time ASC  -- Tiebreaker: who reached the count first
+            LIMIT ?
+        '''
+        try:
+            with self._lock:
+                cursor = self._conn.cursor()
+                # Plain tuples already match (user_id, username, message_count)
+                cursor.row_factory = None
+                leaderboard = cursor.execute(query, (limit,)).fetchall()
         except sqlite3.Error as e:
-            self.logger.error(f"Error generating leaderboard for {period}: {e}")
+            self.logger.error("Error generating leaderboard for %s: %s", period, e)
             return []
+        if cacheable:
+            self._leaderboard_cache[cache_key] = leaderboard
+        return leaderboard
 
-    def update_highest_rank(self, user_id: int, new_rank: int) -> None:
+    def get_user_full_stats(self, user_id: int) -> Dict[str, Any]:
         """
-        Update the user's highest achieved rank.
+        Retrieve user's total messages, highest rank and current rank in every period.
         
         :param user_id: Telegram user ID
-        :param new_rank: New highest rank to set
+        :return: Dict with 'total_messages', 'highest_rank' and 'ranks' (period -> rank or None)
         """
+        self.flush_messages()
+        stats = {
+            'total_messages': 0,
+            'highest_rank': None,
+            'ranks': dict.fromkeys(['daily', 'weekly', 'monthly', 'all_time'])
+        }
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    UPDATE users 
-                    SET highest_rank = ?
-                    WHERE user_id = ?
-                ''', (new_rank, user_id))
-                conn.commit()
+            with self._lock:
+                result = self._conn.execute(_SQL_USER_FULL_STATS, (user_id,)).fetchone()
         except sqlite3.Error as e:
-            self.logger.error(f"Error updating highest rank for user {user_id}: {e}")
+            self.logger.error("Error retrieving full stats for %s: %s", user_id, e)
+            return stats
+        
+        if result:
+            stats['total_messages'] = result['total_messages']
+            stats['highest_rank'] = result['highest_rank']
+            for period in stats['ranks']:
+                stats['ranks'][period] = result[f'{period}_rank']
+        return stats
 
     def get_user_rank(self, user_id: int, period: str = 'all_time') -> Optional[int]:
         """
-        Get user's rank with first-to-count mechanism.
+        Get user's rank with first-to-count mechanism, in the same order as the leaderboard.
         """
+        query = f'''
+            WITH ranked_users AS (
+                SELECT 
+                    user_id, 
+                    ROW_NUMBER() OVER (
+                        ORDER BY 
+                            message_count DESC, 
+                            last_count_time ASC  -- Tiebreaker: who reached the count first
+                    ) AS final_rank
+                FROM ({self._leaderboard_source(period)})
+            )
+            SELECT final_rank 
+            FROM ranked_users 
+            WHERE user_id = ?
+        '''
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                
-                period_filters = {
-                    'daily': 'AND m.timestamp >= date("now", "-1 day")',
-                    'weekly': 'AND m.timestamp >= date("now", "-7 days")',
-                    'monthly': 'AND m.timestamp >= date("now", "-1 month")',
-                    'all_time': ''
-                }
-                
-                query = f'''
-                    WITH user_messages AS (
-                        SELECT 
-                            u.user_id, 
-                            u.username,
-                            COUNT(m.id) as message_count,
-                            MIN(m.timestamp) as first_message_time,
-                            ROW_NUMBER() OVER (
-                                PARTITION BY COUNT(m.id) 
-                                ORDER BY MIN(m.timestamp)
-                            ) as message_count_order
-                        FROM users u
-                        LEFT JOIN messages m ON u.user_id = m.user_id
-                        WHERE 1=1 {period_filters.get(period, '')}
-                        GROUP BY u.user_id, u.username
-                    ),
-                    ranked_messages AS (
-                        SELECT 
-                            um.user_id,  -- Qualified with alias
-                            um.username,
-                            um.message_count,
-                            um.first_message_time,
-                            COUNT(DISTINCT other.message_count) + 1 AS base_rank,
-                            um.message_count_order
-                        FROM user_messages um  -- Main CTE aliased as 'um'
-                        LEFT JOIN user_messages other ON other.message_count > um.message_count
-                        GROUP BY 
-                            um.user_id, 
-                            um.username, 
-                            um.message_count, 
-                            um.first_message_time, 
-                            um.message_count_order
-                    )
-                    SELECT 
-                        base_rank + (message_count_order - 1) AS final_rank
-                    FROM ranked_messages 
-                    WHERE user_id = ?  -- Now unambiguous
-                '''
-                
-                cursor.execute(query, (user_id,))
-                result = cursor.fetchone()
+            with self._lock:
+                result = self._conn.execute(query, (user_id,)).fetchone()
                 return result[0] if result else None
         except sqlite3.Error as e:
-            self.logger.error(f"Error getting user rank for {user_id} in {period}: {e}")
+            self.logger.error("Error getting user rank for %s in %s: %s", user_id, period, e)
             return None
 
     def toggle_notifications(self, user_id: int, subscribe: bool = True) -> None:
@@ -281,26 +485,30 @@ class DatabaseManager:
         :param subscribe: True to subscribe, False to unsubscribe
         """
         try:
-            with self._get_connection() as conn:
+            with self._lock, self._conn as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT OR REPLACE INTO notifications 
                     (user_id, is_subscribed)
                     VALUES (?, ?)
                 ''', (user_id, 1 if subscribe else 0))
-                conn.commit()
         except sqlite3.Error as e:
-            self.logger.error(f"Error toggling notifications for {user_id}: {e}")
+            self.logger.error("Error toggling notifications for %s: %s", user_id, e)
+        self._notification_users_cache.clear()
 
     def get_notification_users(self, limit: int = 1000) -> List[int]:
         """
-        Retrieve users subscribed to notifications.
+        Retrieve users subscribed to notifications, reused for NOTIFICATION_USERS_CACHE_TTL
+        seconds or until a subscription changes.
         
         :param limit: Maximum number of users to return
         :return: List of user IDs
         """
+        notification_users = self._notification_users_cache.get(limit)
+        if notification_users is not None:
+            return notification_users
         try:
-            with self._get_connection() as conn:
+            with self._lock, self._conn as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT user_id 
@@ -308,7 +516,16 @@ class DatabaseManager:
                     WHERE is_subscribed = 1 
                     LIMIT ?
                 ''', (limit,))
-                return [row['user_id'] for row in cursor.fetchall()]
+                notification_users = [row['user_id'] for row in cursor.fetchall()]
         except sqlite3.Error as e:
-            self.logger.error(f"Error retrieving notification users: {e}")
-            return []
\ No newline at end of file
+            self.logger.error("Error retrieving notification users: %s", e)
+            return []
+        self._notification_users_cache[limit] = notification_users
+        return notification_users
+
+    def close(self) -> None:
+        """Finish queued database work, write any buffered messages and close the shared database connection."""
+        self._executor.shutdown(wait=True)
+        self.flush_messages()
+        with self._lock:
+            self._conn.close()
@@ -1,76 +1,86 @@
+import logging
+import time
+
 from database import DatabaseManager
-from config import MILESTONES
+from config import MILESTONES_SET, LEADERBOARD_CACHE_SECONDS
+
+logger = logging.getLogger(__name__)
 
 class LeaderboardManager:
     def __init__(self, db_manager):
         self.db_manager = db_manager
+        # Rendered boards as period -> (time bucket, board), shared by every user asking within the same bucket
+        self._boards = {}
 
     def process_message(self, user_id, username):
         """Process a new message and check for milestones."""
-        # Log message
-        self.db_manager.log_message(user_id, username)
+        # Log message; the new total comes back without another query
+        total_messages = self.db_manager.log_message(user_id, username)
         
-        # Check milestones
-        total_messages = self.db_manager.get_user_stats(user_id)[0]
-
-        milestone_reached = [
-            milestone for milestone in MILESTONES 
-            if total_messages == milestone
-        ]
-
-        # Check and update highest all-time rank
-        current_rank = self.db_manager.get_user_rank(user_id, 'all_time')
-        total_messages, current_highest = self.db_manager.get_user_stats(user_id)
-
-        if current_rank is not None:
-            # Update if:
-            # 1. No previous highest rank (new user)
-            # 2. Current rank is better (lower) than previous best
-            if (current_highest is None) or (current_rank < current_highest):
-                self.db_manager.update_highest_rank(user_id, current_rank)
+        # Check milestones (highest ranks are updated when leaderboards are refreshed)
+        milestone_reached = [total_messages] if total_messages in MILESTONES_SET else []
 
         return milestone_reached
 
-    def get_leaderboard_message(self, period='all-time', user_id=None):
+    def get_leaderboard_message(self, period='all_time', user_id=None):
         """Generate leaderboard message."""
+        board = self._render_board(period)
+        return self._annotate_for_user(board, period, user_id)
+
+    def _render_board(self, period):
+        """Render the leaderboard shared by all users; cached per (period, time bucket)."""
+        # The bucket changes every LEADERBOARD_CACHE_SECONDS, so a cached board is at most that old
+        bucket = int(time.time()) // LEADERBOARD_CACHE_SECONDS
+        cached = self._boards.get(period)
+        if cached and cached[0] == bucket:
+            return cached[1]
+        
         # Get leaderboard
         leaderboard = self.db_manager.get_leaderboard(period)
-        print("leaderaboard",leaderboard)
+        logger.debug("%s leaderboard: %r", period, leaderboard)
         
         # Prepare message
-        message_lines = [f"🏆 {period.capitalize()} Leaderboard:"]
+        message_lines = [f"🏆 {period.replace('_', '-').capitalize()} Leaderboard:"]
         
         for idx, (uid, username, count) in enumerate(leaderboard, 1):
             message_lines.append(f"{idx}. [{username}](tg://user?id={uid}): {count} messages")
 
-            
-        
+        board = "\n".join(message_lines)
+        # An empty result may be a database error, and the all-time board is read live
+        # so it matches the rank shown under it; neither is reused
+        if leaderboard and period != 'all_time':
+            self._boards[period] = (bucket, board)
+        return board
+
+    def _annotate_for_user(self, board, period, user_id):
+        """Append the requesting user's rank to a rendered board."""
         # Add user's rank if provided
         if user_id is not None:
             user_rank = self.db_manager.get_user_rank(user_id, period)
             if user_rank:
-                message_lines.append(f"\nYour Rank: {user_rank}")
+                return f"{board}\n\nYour Rank: {user_rank}"
         
-        return "\n".join(message_lines)
+        return board
 
     def get_user_stats(self, user_id):
         """Generate comprehensive user stats."""
-        # Get total messages and highest rank
-        total_messages, highest_rank = self.db_manager.get_user_stats(user_id)
+        # Get total messages, highest rank and the rank for every period in one query
+        stats = self.db_manager.get_user_full_stats(user_id)
+        period_ranks = stats['ranks']
         
         # Get ranks for different periods
         ranks = {
-            "Daily": self.db_manager.get_user_rank(user_id, 'daily'),
-            "Weekly": self.db_manager.get_user_rank(user_id, 'weekly'),
-            "Monthly": self.db_manager.get_user_rank(user_id, 'monthly'),
-            "All-Time": self.db_manager.get_user_rank(user_id, 'all_time')
+            "Daily": period_ranks['daily'],
+            "Weekly": period_ranks['weekly'],
+            "Monthly": period_ranks['monthly'],
+            "All-Time": period_ranks['all_time']
         }
         
         # Prepare stats message
         stats_message = [
             "🌟 Your Stats:",
-            f"Total Messages: {total_messages}",
-            f"Highest All-Time Rank Achieved: {highest_rank or 'N/A'}",
+            f"Total Messages: {stats['total_messages']}",
+            f"Highest All-Time Rank Achieved: {stats['highest_rank'] or 'N/A'}",
             "\nCurrent Rankings:"
         ]
         
@@ -1,6 +1,12 @@
 import asyncio
+import logging
+from telegram.error import Forbidden, RetryAfter, TelegramError
 from database import DatabaseManager
 
+from config import NOTIFICATION_SEND_CONCURRENCY, NOTIFICATION_SEND_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
 class NotificationManager:
     def __init__(self, bot, db_manager):
         self.bot = bot
@@ -10,7 +16,7 @@ class NotificationManager:
     async def check_leaderboard_changes(self, period='all_time'):
         """Check for leaderboard changes and send notifications."""
         # Get current leaderboard
-        current_leaderboard = self.db_manager.get_leaderboard(period)
+        current_leaderboard = await self.db_manager.run_async(self.db_manager.get_leaderboard, period)
         
         # Compare with previous leaderboard
         if period not in self.previous_leaderboards:
@@ -31,28 +37,28 @@ class NotificationManager:
         self.previous_leaderboards[period] = current_leaderboard
 
     def _detect_leaderboard_changes(self, old_leaderboard, new_leaderboard):
-        """Detect changes in leaderboard."""
-        changes = []
+        """Detect users who entered the leaderboard or moved to a different rank."""
+        old_positions = {(uid, rank) for rank, (uid, _, _) in enumerate(old_leaderboard, 1)}
+        new_positions = {(uid, rank) for rank, (uid, _, _) in enumerate(new_leaderboard, 1)}
+        
+        # Usernames and counts for the current leaderboard, by user
+        new_entries = {uid: (username, count) for uid, username, count in new_leaderboard}
         
-        for new_idx, (new_uid, new_username, new_count) in enumerate(new_leaderboard):
-            # Check if user is new in top positions
-            if new_idx < len(old_leaderboard):
-                old_uid, _, old_count = old_leaderboard[new_idx]
-                
-                # Different user or significant message count change
-                if old_uid != new_uid or abs(new_count - old_count) > 10:
-                    changes.append({
-                        'user_id': new_uid,
-                        'username': new_username,
-                        'new_rank': new_idx + 1,
-                        'message_count': new_count
-                    })
+        changes = []
+        for uid, rank in sorted(new_positions - old_positions, key=lambda position: position[1]):
+            username, count = new_entries[uid]
+            changes.append({
+                'user_id': uid,
+                'username': username,
+                'new_rank': rank,
+                'message_count': count
+            })
         
         return changes
 
     async def _send_notifications(self, changes, period):
         """Send notifications to subscribed users."""
-        notification_users = self.db_manager.get_notification_users()
+        notification_users = await self.db_manager.run_async(self.db_manager.get_notification_users)
         
         notification_text = f"🔔 Leaderboard Update ({period.capitalize()}):\n"
         
@@ -62,15 +68,41 @@ class NotificationManager:
                 f"with {change['message_count']} messages!\n"
             )
         
-        # Send notifications
-        for user_id in notification_users:
-            try:
-                await self.bot.send_message(
-                    chat_id=user_id, 
-                    text=notification_text
-                )
-            except Exception as e:
-                print(
-                    f"❌ Failed to send notification to {user_id}: {e}. "
-                    "This might be because the user hasn't started a private chat with the bot yet."
-                )
+        # Send notifications concurrently, with a bounded number in flight
+        semaphore = asyncio.Semaphore(NOTIFICATION_SEND_CONCURRENCY)
+
+        async def send(user_id):
+            async with semaphore:
+                for attempt in range(1, NOTIFICATION_SEND_ATTEMPTS + 1):
+                    try:
+                        await self.bot.send_message(
+                            chat_id=user_id, 
+                            text=notification_text
+                        )
+                        return
+                    except RetryAfter as e:
+                        if attempt == NOTIFICATION_SEND_ATTEMPTS:
+                            logger.warning(
+                                "Gave up sending notification to %s after %s rate-limited attempts",
+                                user_id, NOTIFICATION_SEND_ATTEMPTS
+                            )
+                            return
+                        # Over Telegram's broadcast limit; wait as instructed, holding the slot so others slow down too
+                        logger.info("Rate limited sending notification to %s (attempt %s), retrying in %s s", user_id, attempt, e.retry_after)
+                        await asyncio.sleep(e.retry_after)
+                    except Forbidden as e:
+                        logger.warning(
+                            "Failed to send notification to %s: %s. "
+                            "This might be because the user hasn't started a private chat with the bot yet.",
+                            user_id, e
+                        )
+                        return
+                    except TelegramError as e:
+                        logger.warning("Failed to send notification to %s: %s", user_id, e)
+                        return
+                    except Exception as e:
+                        logger.exception("Unexpected error sending notification to %s: %s", user_id, e)
+                        return
+
+        # One failed send must not stop the others or the rest of the leaderboard check
+        await asyncio.gather(*(send(user_id) for user_id in notification_users), return_exceptions=True)